@@ -1,9 +1,52 @@
 import sqlite3
 import csv
 import os
+import tempfile
 from typing import List
+from typing import Optional
 from typing import Tuple
 
+from stoptimes import map_chunks, read_header, read_rows
+
+STOP_TIMES_COLUMNS = ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence', 'stop_headsign']
+
+STOP_TIMES_COLUMN_DEFS = '''
+                trip_id TEXT,
+                arrival_time TEXT,
+                departure_time TEXT,
+                stop_id TEXT,
+                stop_sequence INTEGER,
+                stop_headsign TEXT'''
+
+# Column indexes and scratch directory for load_stop_times workers, set once
+# per worker process by _init_load_worker.
+_worker_column_indexes: Optional[List[int]] = None
+_worker_tmp_dir: Optional[str] = None
+
+def _init_load_worker(column_indexes: List[int], tmp_dir: str) -> None:
+    global _worker_column_indexes, _worker_tmp_dir
+    _worker_column_indexes = column_indexes
+    _worker_tmp_dir = tmp_dir
+
+def _load_stop_times_chunk(path: str, start: int, end: int) -> str:
+    """
+    Parses one chunk of stop_times.txt into its own SQLite file and returns
+    that file's path, so only the path is sent back to the parent process.
+    """
+    trip_id, arrival_time, departure_time, stop_id, stop_sequence, stop_headsign = _worker_column_indexes
+    chunk_db_path = f'{_worker_tmp_dir}/stop_times_{start}.db'
+    conn = sqlite3.connect(chunk_db_path)
+    # Throwaway file, so skip the journal and fsyncs.
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute(f'CREATE TABLE stop_times ({STOP_TIMES_COLUMN_DEFS})')
+    conn.executemany(
+        'INSERT INTO stop_times (trip_id, arrival_time, departure_time, stop_id, stop_sequence, stop_headsign) VALUES (?, ?, ?, ?, ?, ?)',
+        ((row[trip_id], row[arrival_time], row[departure_time], row[stop_id], row[stop_sequence], row[stop_headsign] or None) for row in read_rows(path, start, end)))
+    conn.commit()
+    conn.close()
+    return chunk_db_path
+
 class BartDb:
     DB_PATH = f'{os.environ["BART_DATA_ROOT"]}/bartdb.db'
     def __init__(self):
@@ -24,25 +67,30 @@ class BartDb:
 
         self.cursor.execute('''DROP TABLE IF EXISTS stop_times;''')
 
-        self.cursor.execute('''
-            CREATE TABLE stop_times (
-                trip_id TEXT,
-                arrival_time TEXT,
-                departure_time TEXT,
-                stop_id TEXT,
-                stop_sequence INTEGER,
-                stop_headsign TEXT,
+        self.cursor.execute(f'''
+            CREATE TABLE stop_times ({STOP_TIMES_COLUMN_DEFS},
                 PRIMARY KEY (trip_id, stop_sequence)
             )
         ''')
         self.conn.commit()
 
-        with open(f'{os.environ["BART_DATA_ROOT"]}/stop_times.txt', 'r') as f:
-            reader = csv.DictReader(f)
-            stop_times = [(row['trip_id'], row['arrival_time'], row['departure_time'], row['stop_id'], row['stop_sequence'], row['stop_headsign'] or None) for row in reader]
-
-        self.cursor.executemany('INSERT INTO stop_times (trip_id, arrival_time, departure_time, stop_id, stop_sequence, stop_headsign) VALUES (?, ?, ?, ?, ?, ?)', stop_times)
-        self.conn.commit()
+        # Workers parse chunks into temporary databases in parallel; this
+        # connection only copies them in, so no rows are pickled between
+        # processes.
+        stop_times_path = f'{os.environ["BART_DATA_ROOT"]}/stop_times.txt'
+        header = read_header(stop_times_path)
+        column_indexes = [header.index(column) for column in STOP_TIMES_COLUMNS]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            chunk_db_paths = map_chunks(
+                stop_times_path,
+                _load_stop_times_chunk,
+                initializer=_init_load_worker,
+                initargs=(column_indexes, tmp_dir))
+            for chunk_db_path in chunk_db_paths:
+                self.cursor.execute('ATTACH DATABASE ? AS chunk', (chunk_db_path,))
+                self.cursor.execute('INSERT INTO stop_times SELECT trip_id, arrival_time, departure_time, stop_id, stop_sequence, stop_headsign FROM chunk.stop_times')
+                self.conn.commit()
+                self.cursor.execute('DETACH DATABASE chunk')
 
     def load_trips(self):
         if not self.conn:
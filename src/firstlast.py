@@ -1,13 +1,16 @@
 from collections import namedtuple
-from typing import List, Tuple, Optional, Dict, Set, Callable, Iterable
+from typing import List, Tuple, Optional, Dict, Set, Callable, Iterable, Container
 import os
 import csv
+import tempfile
 
 from bartdb import BartDb
+from stoptimes import map_chunks, read_rows
 
 STOPS_FILE_NAME = "stops.txt"
 STOP_TIMES_FILE_NAME = "stop_times.txt"
 TRIPS_FILE_NAME = "trips.txt"
+ROUTES_FILE_NAME = "routes.txt"
 
 DALY_CITY_AMBIGUOUS = "1"
 AMBIGUOUS = set([DALY_CITY_AMBIGUOUS])
@@ -110,7 +113,18 @@ def get_station_ids(station_name: str) -> List[str]:
                 stop_ids.append(stop_id)
     return stop_ids
 
-TripInfo = namedtuple("TripInfo", ["service_id", "trip_id", "trip_headsign"])
+def get_route_short_name_for_id() -> Dict[str, str]:
+    """
+    Returns a dictionary mapping route IDs to their short names.
+    """
+    route_id_short_name_map = {}
+    with open(f"{os.environ['BART_DATA_ROOT']}/{ROUTES_FILE_NAME}", "r") as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            route_id_short_name_map[row['route_id']] = row['route_short_name']
+    return route_id_short_name_map
+
+TripInfo = namedtuple("TripInfo", ["service_id", "trip_id", "trip_headsign", "route_id"])
 
 
 TripId = str
@@ -122,6 +136,7 @@ def trips_dict(filter_func: Optional[Callable]=None) -> Dict[TripId, TripInfo]:
         trips: Dict[TripId, TripInfo] = {}
         for row in reader:
             trip_id: TripId = row[2]
+            route_id = row[0]
             service_id = row[1]
             trip_headsign = row[3]
             if filter_func is None or filter_func(trip_id, service_id, trip_headsign):
@@ -129,6 +144,7 @@ def trips_dict(filter_func: Optional[Callable]=None) -> Dict[TripId, TripInfo]:
                     service_id=service_id,
                     trip_id=trip_id,
                     trip_headsign=trip_headsign,
+                    route_id=route_id,
             )
         return trips
 
@@ -136,30 +152,83 @@ StopTimeInfo = namedtuple(
     "StopTimeInfo", ["departure_time", "stop_headsign", "trip_id", "service_id", "stop_id"])
 
 
+def stop_time_info_for_row(
+        row: List[str],
+        target_station_ids: Optional[Container[str]],
+        trips_dict: Optional[Dict[TripId, TripInfo]] = None) -> Optional[StopTimeInfo]:
+    # trip_id,arrival_time,departure_time,stop_id,stop_sequence,stop_headsign,pickup_type,drop_off_type,shape_distance_traveled
+    stop_id = row[3]
+    if target_station_ids is not None and stop_id not in target_station_ids:
+        return None
+    trip_id = row[0]
+    departure_time = row[2]
+    stop_headsign = row[5]
+    if trips_dict and not stop_headsign:
+        stop_headsign = trips_dict[trip_id].trip_headsign
+
+    if trips_dict:
+        service_id = trips_dict[trip_id].service_id
+    else:
+        service_id = None
+
+    return StopTimeInfo(departure_time, stop_headsign, trip_id, service_id, stop_id)
+
+
+# Stop filter and trips table for get_stop_times/first_last_times_parallel
+# workers, set once per worker process by _init_filter_worker so they are not
+# pickled with every chunk.
+_worker_target_station_ids: Optional[Set[str]] = None
+_worker_trips_dict: Optional[Dict[TripId, TripInfo]] = None
+
+def _init_filter_worker(
+        target_station_ids: Optional[List[str]],
+        trips_dict: Optional[Dict[TripId, TripInfo]]) -> None:
+    global _worker_target_station_ids, _worker_trips_dict
+    _worker_target_station_ids = set(target_station_ids) if target_station_ids is not None else None
+    _worker_trips_dict = trips_dict
+
+def _stop_times_for_chunk(path: str, start: int, end: int) -> List[Tuple[str, str, str, str, str]]:
+    # Plain tuples pickle noticeably faster than namedtuples.
+    stop_times: List[Tuple[str, str, str, str, str]] = []
+    for row in read_rows(path, start, end):
+        stop_time_info = stop_time_info_for_row(row, _worker_target_station_ids, _worker_trips_dict)
+        if stop_time_info is not None:
+            stop_times.append(tuple(stop_time_info))
+    return stop_times
+
 def get_stop_times(
         target_station_ids: Optional[List[str]],
-        trips_dict: Optional[Dict[TripId, TripInfo]] = None) -> List[StopTimeInfo]:
+        trips_dict: Optional[Dict[TripId, TripInfo]] = None,
+        workers: Optional[int] = None) -> List[StopTimeInfo]:
+    """
+    Returns the stop times at the given stops (or all stops), in file order.
+
+    With a stop filter, stop_times.txt is split into line-aligned chunks that
+    are parsed and filtered across a process pool, and only the matching rows
+    come back. Each call starts a new pool, which costs a few tenths of a
+    second, so a small filter on a machine with few cores can be slower than a
+    serial read; pass workers=1 to keep the pool to one process. Without a
+    filter, every row would have to be pickled back to this process, which
+    costs more than parsing here, so the file is read serially.
+    """
+    stop_times_path = f"{os.environ['BART_DATA_ROOT']}/{STOP_TIMES_FILE_NAME}"
+    if target_station_ids is not None:
+        chunks = map_chunks(
+            stop_times_path,
+            _stop_times_for_chunk,
+            workers=workers,
+            initializer=_init_filter_worker,
+            initargs=(target_station_ids, trips_dict))
+        return [StopTimeInfo._make(stop_time) for chunk in chunks for stop_time in chunk]
+
     trips: List[StopTimeInfo] = []
-    with open(f"{os.environ["BART_DATA_ROOT"]}/{STOP_TIMES_FILE_NAME}", "r")  as f:
+    with open(stop_times_path, "r")  as f:
         reader = csv.reader(f)
         next(reader) # Skip header row
         for row in reader:
-            # trip_id,arrival_time,departure_time,stop_id,stop_sequence,stop_headsign,pickup_type,drop_off_type,shape_distance_traveled
-            stop_id = row[3]
-            if target_station_ids is None or stop_id in target_station_ids:
-                trip_id = row[0]
-                departure_time = row[2]
-                stop_id = row[3]
-                stop_headsign = row[5]
-                if trips_dict and not stop_headsign:
-                    stop_headsign = trips_dict[trip_id].trip_headsign
-
-                if trips_dict:
-                    service_id = trips_dict[trip_id].service_id
-                else:
-                    service_id = None
-
-                trips.append(StopTimeInfo(departure_time, stop_headsign, trip_id, service_id, stop_id))
+            stop_time_info = stop_time_info_for_row(row, target_station_ids, trips_dict)
+            if stop_time_info is not None:
+                trips.append(stop_time_info)
 
     return trips
 
@@ -174,13 +243,51 @@ def first_last_times(trips: List[StopTimeInfo]) -> Dict[ServiceIdHeadsign, First
     for stop_time_info in trips:
         key = ServiceIdHeadsign(stop_time_info.service_id, stop_time_info.stop_headsign)
         time = stop_time_info.departure_time
-        if time < first_map.get(key, "99:99:99"):
+        if not time:
+            continue
+        if key not in first_map or time < first_map[key]:
             first_map[key] = time
-        if time > last_map.get(key, "00:00:00"):
+        if key not in last_map or time > last_map[key]:
             last_map[key] = time
 
     return {key: FirstLastTimes(first_map[key], last_map[key]) for key in first_map}
 
+def _first_last_times_for_chunk(path: str, start: int, end: int) -> Dict[ServiceIdHeadsign, FirstLastTimes]:
+    trips: List[StopTimeInfo] = []
+    for row in read_rows(path, start, end):
+        stop_time_info = stop_time_info_for_row(row, _worker_target_station_ids, _worker_trips_dict)
+        if stop_time_info is not None:
+            trips.append(stop_time_info)
+    return first_last_times(trips)
+
+def merge_first_last_times(
+        partials: Iterable[Dict[ServiceIdHeadsign, FirstLastTimes]]) -> Dict[ServiceIdHeadsign, FirstLastTimes]:
+    merged: Dict[ServiceIdHeadsign, FirstLastTimes] = {}
+    for partial in partials:
+        for key, times in partial.items():
+            if key in merged:
+                times = FirstLastTimes(min(merged[key].first, times.first), max(merged[key].last, times.last))
+            merged[key] = times
+    return merged
+
+def first_last_times_parallel(
+        target_station_ids: Optional[List[str]],
+        trips_dict: Optional[Dict[TripId, TripInfo]] = None,
+        workers: Optional[int] = None) -> Dict[ServiceIdHeadsign, FirstLastTimes]:
+    """
+    Same result as first_last_times(get_stop_times(target_station_ids, trips_dict)),
+    but stop_times.txt is split into line-aligned chunks parsed across a process
+    pool. Each worker filters and aggregates its own chunk; only the partial
+    first/last maps are sent back and merged.
+    """
+    partials = map_chunks(
+        f"{os.environ['BART_DATA_ROOT']}/{STOP_TIMES_FILE_NAME}",
+        _first_last_times_for_chunk,
+        workers=workers,
+        initializer=_init_filter_worker,
+        initargs=(target_station_ids, trips_dict))
+    return merge_first_last_times(partials)
+
 def get_label_for_service_id(service_id: str) -> str:
     service_map = {
         # Mainline
@@ -306,7 +413,10 @@ def print_first_last_train_per_station(bart_db: BartDb, station_name: str) -> No
         print(train)
 
 def print_first_last_times_table(trips: List[StopTimeInfo], station_name: Optional[str] = None) -> None:
-    first_last = first_last_times(trips)
+    print_first_last_table(first_last_times(trips), station_name)
+
+def print_first_last_table(
+        first_last: Dict[ServiceIdHeadsign, FirstLastTimes], station_name: Optional[str] = None) -> None:
     display_map = {f"{get_label_for_service_id(service_id)} - {get_line_for_headsign(headsign, station_name)}":
                    v for (service_id, headsign), v in first_last.items()}
     destinations = set(map(lambda key: key.split(' - ')[1], display_map.keys()))
@@ -390,8 +500,8 @@ def test_headsign_names() -> bool:
 
 
 def print_first_last_for_station(station_name: str) -> None:
-    stop_times = get_stop_times(get_station_ids(station_name), trips_dict())
-    print_first_last_times_table(stop_times, station_name)
+    first_last = first_last_times_parallel(get_station_ids(station_name), trips_dict())
+    print_first_last_table(first_last, station_name)
 
 TEST_HEADSIGNS = True
 
@@ -415,6 +525,51 @@ def test_daly_city_service() -> None:
     headsign = "OAK Airport / SF / Daly City"
     assertEqual(get_line_for_headsign(headsign, station_name), line_name)
 
+def test_stop_times_parallel() -> None:
+    """
+    Checks that get_stop_times and first_last_times_parallel match a serial
+    parse for any number of chunks, including rows with no departure time.
+    """
+    header = "trip_id,arrival_time,departure_time,stop_id,stop_sequence,stop_headsign,pickup_type,drop_off_type,shape_distance_traveled\n"
+    rows = [
+        "t1,05:10:00,05:10:00,A,1,,0,0,\n",
+        "t2,,,A,1,,0,0,\n",
+        "t1,05:20:00,05:20:00,B,2,Richmond,0,0,\n",
+        "t2,00:00:00,00:00:00,B,2,,0,0,\n",
+        "t3,,,A,1,,0,0,\n",
+        "t1,25:01:00,25:01:00,C,3,,0,0,\n",
+    ]
+    test_trips = {
+        "t1": TripInfo("Weekday", "t1", "Antioch", "1"),
+        "t2": TripInfo("Weekday", "t2", "Daly City", "1"),
+        "t3": TripInfo("Sunday", "t3", "Antioch", "1"),
+    }
+    data_root = os.environ.get("BART_DATA_ROOT")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["BART_DATA_ROOT"] = tmp_dir
+        try:
+            for file_rows in (rows, []):
+                with open(f"{tmp_dir}/{STOP_TIMES_FILE_NAME}", "w") as f:
+                    f.write(header + "".join(file_rows))
+                for target_station_ids in (None, ["A"], ["B", "C"]):
+                    for test_trips_dict in (test_trips, None):
+                        expected = [
+                            stop_time_info
+                            for stop_time_info in (
+                                stop_time_info_for_row(row, target_station_ids, test_trips_dict)
+                                for row in csv.reader(file_rows))
+                            if stop_time_info is not None]
+                        for workers in (1, 2, 3, len(rows) + 3):
+                            assertEqual(get_stop_times(target_station_ids, test_trips_dict, workers), expected)
+                            assertEqual(
+                                first_last_times_parallel(target_station_ids, test_trips_dict, workers),
+                                first_last_times(expected))
+        finally:
+            if data_root is None:
+                del os.environ["BART_DATA_ROOT"]
+            else:
+                os.environ["BART_DATA_ROOT"] = data_root
+
 def all_stops_for(station_name: str) -> List[StopTimeInfo]:
     weekday_trips = trips_dict()
     stop_times = get_stop_times(get_station_ids(station_name), weekday_trips)
@@ -434,6 +589,7 @@ if __name__ == "__main__":
             print("Some headsigns are missing mappings in HEADSIGN_MAP.")
             exit(1)
     test_daly_city_service()
+    test_stop_times_parallel()
     # print_system_first_last_times()
     #print_first_last_for_station("Daly City")
 
@@ -446,8 +602,8 @@ if __name__ == "__main__":
     #print_first_last_train_per_station(bartdb, "19th")
     trips_dict = trips_dict()
     station_name = "Bay Fair"
-    stop_times = get_stop_times(get_station_ids(station_name), trips_dict)
-    print_first_last_times_table(stop_times, station_name)
+    first_last = first_last_times_parallel(get_station_ids(station_name), trips_dict)
+    print_first_last_table(first_last, station_name)
     #bartdb.disconnect()
     #test_daly_city_service()
     #print(trips_dict())
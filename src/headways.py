@@ -0,0 +1,240 @@
+from collections import namedtuple
+from typing import Dict, List, Optional, Tuple
+import json
+
+from firstlast import (
+    StopTimeInfo,
+    TripId,
+    TripInfo,
+    assertEqual,
+    get_label_for_service_id,
+    get_line_for_headsign,
+    get_route_short_name_for_id,
+    get_station_ids,
+    get_station_name_for_id,
+    get_stop_times,
+    map_route_short_name,
+    trips_dict,
+)
+
+HeadwayKey = namedtuple("HeadwayKey", ["station_name", "service", "line"])
+
+# trains_per_hour maps the service-day hour (which can run past 23 for
+# after-midnight trains) to the number of departures in that hour.
+# max_gap and max_gap_start are in seconds, or None with fewer than two trains.
+HeadwayStats = namedtuple("HeadwayStats", ["trains_per_hour", "max_gap", "max_gap_start"])
+
+
+def time_to_seconds(time: str) -> int:
+    hours, minutes, seconds = time.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def seconds_to_time(seconds: int) -> str:
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def headway_stats(
+        stop_times: List[StopTimeInfo],
+        trips: Optional[Dict[TripId, TripInfo]] = None,
+        by_route: bool = False,
+        station_names_for_id: Optional[Dict[str, str]] = None,
+        route_short_names: Optional[Dict[str, str]] = None) -> Dict[HeadwayKey, HeadwayStats]:
+    """
+    Computes hourly train counts and the worst gap between trains for every
+    station, service day and line in stop_times.
+
+    Each row needs a service_id and headsign. Rows read without a trips dict
+    have neither, so pass trips to fill them in from the row's trip; trips is
+    also needed when by_route is set to find each trip's route. Lines come
+    from get_line_for_headsign, or from map_route_short_name when by_route is
+    set. Station and route names are read from the feed unless passed in.
+    Departures are sorted once by key and time, then each group's histogram
+    and gap are built in a single pass.
+    """
+    if by_route and trips is None:
+        raise Exception("trips is required when grouping by route.")
+    if station_names_for_id is None:
+        station_names_for_id = get_station_name_for_id()
+    if by_route and route_short_names is None:
+        route_short_names = get_route_short_name_for_id()
+
+    keyed_times: List[Tuple[HeadwayKey, int]] = []
+    for stop_time_info in stop_times:
+        if not stop_time_info.departure_time:
+            continue
+        service_id = stop_time_info.service_id
+        stop_headsign = stop_time_info.stop_headsign
+        if trips is not None and (service_id is None or not stop_headsign):
+            trip = trips[stop_time_info.trip_id]
+            service_id = trip.service_id if service_id is None else service_id
+            stop_headsign = stop_headsign or trip.trip_headsign
+        if service_id is None:
+            raise Exception(
+                f"No service_id for trip {stop_time_info.trip_id}. Pass trips to headway_stats.")
+        station_name = station_names_for_id.get(stop_time_info.stop_id, stop_time_info.stop_id)
+        if by_route:
+            route_id = trips[stop_time_info.trip_id].route_id
+            line = map_route_short_name(route_short_names.get(route_id, route_id))
+        else:
+            line = get_line_for_headsign(stop_headsign, station_name)
+        key = HeadwayKey(station_name, get_label_for_service_id(service_id), line)
+        keyed_times.append((key, time_to_seconds(stop_time_info.departure_time)))
+    keyed_times.sort()
+
+    stats: Dict[HeadwayKey, HeadwayStats] = {}
+    current_key: Optional[HeadwayKey] = None
+    previous_time = 0
+    trains_per_hour: Dict[int, int] = {}
+    max_gap: Optional[int] = None
+    max_gap_start: Optional[int] = None
+    for key, time in keyed_times:
+        if key != current_key:
+            if current_key is not None:
+                stats[current_key] = HeadwayStats(trains_per_hour, max_gap, max_gap_start)
+            current_key = key
+            trains_per_hour = {}
+            max_gap = None
+            max_gap_start = None
+        else:
+            gap = time - previous_time
+            if max_gap is None or gap > max_gap:
+                max_gap = gap
+                max_gap_start = previous_time
+        hour = time // 3600
+        trains_per_hour[hour] = trains_per_hour.get(hour, 0) + 1
+        previous_time = time
+    if current_key is not None:
+        stats[current_key] = HeadwayStats(trains_per_hour, max_gap, max_gap_start)
+
+    return stats
+
+
+def sorted_headway_keys(stats: Dict[HeadwayKey, HeadwayStats]) -> List[HeadwayKey]:
+    service_order = ["Weekday", "Saturday", "Sunday"]
+    return sorted(stats, key=lambda key: (
+        key.station_name,
+        service_order.index(key.service) if key.service in service_order else len(service_order),
+        key.service,
+        key.line))
+
+
+def print_headway_table(stats: Dict[HeadwayKey, HeadwayStats]) -> None:
+    if not stats:
+        return
+    keys = sorted_headway_keys(stats)
+    hours = range(
+        min(min(v.trains_per_hour) for v in stats.values()),
+        max(max(v.trains_per_hour) for v in stats.values()) + 1)
+
+    station_len = max(len("Station"), max(len(key.station_name) for key in keys))
+    service_len = max(len("Service"), max(len(key.service) for key in keys))
+    line_len = max(len("Line"), max(len(key.line) for key in keys))
+    time_len = 8  # Length of time strings (HH:MM:SS)
+    hour_len = max(2, max(len(str(count)) for v in stats.values() for count in v.trains_per_hour.values()))
+
+    header_str = " | ".join([
+        "Station".ljust(station_len),
+        "Service".ljust(service_len),
+        "Line".ljust(line_len),
+        "Max Gap".ljust(time_len),
+        "Gap From".ljust(time_len),
+    ] + [f"{hour:02d}".rjust(hour_len) for hour in hours])
+    header_str = f"| {header_str} |"
+
+    def print_dashes():
+        print("-" * len(header_str))
+    print_dashes()
+    print(header_str)
+    print_dashes()
+
+    for key in keys:
+        value = stats[key]
+        max_gap = seconds_to_time(value.max_gap) if value.max_gap is not None else ""
+        max_gap_start = seconds_to_time(value.max_gap_start) if value.max_gap_start is not None else ""
+        row_str = " | ".join([
+            key.station_name.ljust(station_len),
+            key.service.ljust(service_len),
+            key.line.ljust(line_len),
+            max_gap.ljust(time_len),
+            max_gap_start.ljust(time_len),
+        ] + [str(value.trains_per_hour.get(hour, "")).rjust(hour_len) for hour in hours])
+        print(f"| {row_str} |")
+
+    print_dashes()
+
+
+def headway_stats_json(stats: Dict[HeadwayKey, HeadwayStats]) -> str:
+    rows = []
+    for key in sorted_headway_keys(stats):
+        value = stats[key]
+        rows.append({
+            "station_name": key.station_name,
+            "service": key.service,
+            "line": key.line,
+            "trains_per_hour": {f"{hour:02d}": count for hour, count in sorted(value.trains_per_hour.items())},
+            "max_gap_seconds": value.max_gap,
+            "max_gap_start": seconds_to_time(value.max_gap_start) if value.max_gap_start is not None else None,
+        })
+    return json.dumps(rows, indent=2)
+
+
+def print_headways_for_station(station_name: Optional[str], as_json: bool = False) -> None:
+    """
+    Prints headway stats for the given station, or for every station when
+    station_name is None, as a table or as JSON.
+    """
+    all_trips = trips_dict()
+    target_station_ids = get_station_ids(station_name) if station_name is not None else None
+    stats = headway_stats(get_stop_times(target_station_ids, all_trips), all_trips)
+    if as_json:
+        print(headway_stats_json(stats))
+    else:
+        print_headway_table(stats)
+
+
+def test_headway_stats_single_pass() -> None:
+    station_names_for_id = {"TEST_STOP": "Test Station"}
+    trips = {
+        "t1": TripInfo("2025_08_11-DX-MVS-Weekday-003", "t1", "Antioch", "1"),
+        "t2": TripInfo("2025_08_11-DX-MVS-Weekday-003", "t2", "Antioch", "1"),
+        "t3": TripInfo("2025_08_11-DX-MVS-Weekday-003", "t3", "Antioch", "2"),
+    }
+    stop_times = [
+        StopTimeInfo("06:20:00", "Antioch", "t3", trips["t3"].service_id, "TEST_STOP"),
+        StopTimeInfo("05:10:00", "Antioch", "t1", trips["t1"].service_id, "TEST_STOP"),
+        StopTimeInfo("05:30:00", "Antioch", "t2", trips["t2"].service_id, "TEST_STOP"),
+        StopTimeInfo("", "Antioch", "t2", trips["t2"].service_id, "TEST_STOP"),
+    ]
+    stats = headway_stats(stop_times, station_names_for_id=station_names_for_id)
+    key = HeadwayKey("Test Station", "Weekday", "Yellow NB (Antioch)")
+    assertEqual(list(stats), [key])
+    assertEqual(stats[key].trains_per_hour, {5: 2, 6: 1})
+    assertEqual(stats[key].max_gap, time_to_seconds("00:50:00"))
+    assertEqual(stats[key].max_gap_start, time_to_seconds("05:30:00"))
+
+    # Rows read without a trips dict get their service and headsign from trips.
+    bare_stop_times = [stop_time._replace(service_id=None, stop_headsign="") for stop_time in stop_times]
+    assertEqual(headway_stats(bare_stop_times, trips, station_names_for_id=station_names_for_id), stats)
+    raised = False
+    try:
+        headway_stats(bare_stop_times, station_names_for_id=station_names_for_id)
+    except Exception:
+        raised = True
+    assertEqual(raised, True)
+
+    # Grouping by route splits t3 off onto its own (renamed) route.
+    route_short_names = {"1": "Yellow-N", "2": "Green-S"}
+    stats = headway_stats(
+        stop_times, trips, by_route=True,
+        station_names_for_id=station_names_for_id, route_short_names=route_short_names)
+    yellow = HeadwayKey("Test Station", "Weekday", "Yellow-N")
+    green = HeadwayKey("Test Station", "Weekday", "Green-W")
+    assertEqual(sorted(stats), sorted([yellow, green]))
+    assertEqual(stats[yellow], HeadwayStats({5: 2}, time_to_seconds("00:20:00"), time_to_seconds("05:10:00")))
+    assertEqual(stats[green], HeadwayStats({6: 1}, None, None))
+
+if __name__ == "__main__":
+    test_headway_stats_single_pass()
+    print_headways_for_station("Bay Fair")
+    #print_headways_for_station(None, as_json=True)
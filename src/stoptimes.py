@@ -0,0 +1,120 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple, TypeVar
+import csv
+import io
+import locale
+import os
+import tempfile
+
+T = TypeVar("T")
+
+ByteRange = Tuple[int, int]
+
+# Same encoding open() uses by default, so chunks decode the way the serial
+# csv.reader/csv.DictReader paths read the file.
+ENCODING = locale.getpreferredencoding(False)
+
+
+def read_header(path: str) -> List[str]:
+    """
+    Returns the column names from the first line of a CSV file.
+    """
+    with open(path, "r", encoding=ENCODING) as f:
+        return next(csv.reader(f))
+
+
+def line_aligned_ranges(path: str, chunks: int) -> List[ByteRange]:
+    """
+    Splits the rows of a CSV file (everything after the header) into at most
+    `chunks` byte ranges, each starting and ending on a line boundary.
+
+    Splitting on raw newline bytes assumes that no quoted field contains a
+    newline, which csv.reader would otherwise accept, and that ENCODING is
+    ASCII-compatible so a newline byte never falls inside a character. Both
+    hold for GTFS stop_times.txt.
+    """
+    with open(path, "rb") as f:
+        f.readline()  # Skip header row
+        data_start = f.tell()
+        size = os.fstat(f.fileno()).st_size
+        boundaries = [data_start]
+        for i in range(1, chunks):
+            offset = data_start + (size - data_start) * i // chunks
+            # Back up one byte so an offset already at a line start is kept.
+            f.seek(offset - 1)
+            f.readline()
+            aligned = f.tell()
+            if boundaries[-1] < aligned < size:
+                boundaries.append(aligned)
+        boundaries.append(size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if start < end]
+
+
+def read_rows(path: str, start: int, end: int) -> Iterator[List[str]]:
+    """
+    Yields the non-empty CSV rows in the byte range [start, end) of a file.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start).decode(ENCODING)
+    return (row for row in csv.reader(io.StringIO(data)) if row)
+
+
+def available_cpus() -> int:
+    """
+    Returns the number of CPUs this process may run on. Uses the CPU affinity
+    mask (which includes cgroup cpusets) where the platform provides it,
+    falling back to os.cpu_count().
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def map_chunks(
+        path: str,
+        worker: Callable[[str, int, int], T],
+        workers: Optional[int] = None,
+        initializer: Optional[Callable] = None,
+        initargs: Tuple = ()) -> List[T]:
+    """
+    Runs worker(path, start, end) over line-aligned chunks of a CSV file in a
+    process pool and returns the per-chunk results in file order.
+
+    worker must be a module-level function so it can be sent to the pool.
+    initializer/initargs run once per process, which is the place to hand
+    over large lookup tables instead of pickling them with every chunk.
+    """
+    workers = workers or available_cpus()
+    ranges = line_aligned_ranges(path, workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        return list(executor.map(
+            worker,
+            [path] * len(ranges),
+            [start for start, _ in ranges],
+            [end for _, end in ranges]))
+
+
+def test_line_aligned_ranges_cover_rows() -> None:
+    """
+    Checks that the chunks of a file together yield every data row exactly
+    once, in order, for any number of chunks.
+    """
+    header = "trip_id,arrival_time,departure_time\n"
+    rows = [f"t{i},05:{i:02d}:00,05:{i:02d}:00\n" for i in range(7)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = f"{tmp_dir}/stop_times.txt"
+        for file_rows in (rows, rows[:1], []):
+            with open(path, "w") as f:
+                f.write(header + "".join(file_rows))
+            expected = list(csv.reader(file_rows))
+            for chunks in range(1, len(rows) + 4):
+                ranges = line_aligned_ranges(path, chunks)
+                assert len(ranges) <= chunks, ranges
+                actual = [row for start, end in ranges for row in read_rows(path, start, end)]
+                assert actual == expected, (chunks, actual)
+            assert read_header(path) == ["trip_id", "arrival_time", "departure_time"]
+
+
+if __name__ == "__main__":
+    test_line_aligned_ranges_cover_rows()